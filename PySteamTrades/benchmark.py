@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Offscreen scaling benchmark for Model and its proxies on synthetic trees of trades and matches
+
+import sys, os, argparse, time, random
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5.QtWidgets import QApplication, QTreeView
+from PyQt5.QtGui import QIcon, QPixmap
+from PyQt5.QtCore import Qt, QModelIndex
+from PyQt5.QtTest import QAbstractItemModelTester
+from PySteamTrades import main as pst
+
+def tradeUrl(n):
+    return '{}/trade/{:05x}/'.format(pst.siteUrl, n)
+
+def timed(items, func, budget):
+    # runs func over items until done or out of time, returns (done, elapsed)
+    start = time.perf_counter()
+    done = 0
+    for item in items:
+        func(item)
+        done += 1
+        if time.perf_counter() - start > budget:
+            break
+    return done, time.perf_counter() - start
+
+def report(op, size, total, result):
+    done, elapsed = result
+    perOp = elapsed / done * 1e6 if done else 0
+    note = '' if done == total else ' (out of time)'
+    print('{:<24} {:>6} trades: {:>6}/{:<6} in {:8.3f} s, {:10.1f} us each{}'.format(op, size, done, total, elapsed, perOp, note))
+
+class Tree:
+    def __init__(self, size, matches, bookmarked, check = False):
+        self.model = pst.Model()
+        self.filterModel = pst.FilterModel(self.model.searchIndex)
+        self.filterModel.setSourceModel(self.model)
+        self.bookmarks = set(tradeUrl(n) for n in range(0, size, max(1, int(1 / bookmarked)))) if bookmarked else set()
+        self.bookmarksModel = pst.BookmarksModel(self.bookmarks, self.model.searchIndex)
+        self.bookmarksModel.setSourceModel(self.model)
+        self.testers = []
+        if check:
+            for model in [self.model, self.filterModel, self.bookmarksModel]:
+                self.testers.append(QAbstractItemModelTester(model, QAbstractItemModelTester.FailureReportingMode.Fatal))
+        # the same two views as the main window
+        self.views = []
+        for model in [self.filterModel, self.bookmarksModel]:
+            view = QTreeView()
+            view.setModel(model)
+            view.setItemDelegate(pst.ItemDelegate())
+            view.setIconSize(pst.iconSize)
+            view.show()
+            self.views.append(view)
+        self.icon = QIcon(QPixmap(pst.iconSize))
+        self.matches = matches
+    def close(self):
+        for view in self.views:
+            view.setModel(None)
+    def insert(self, n):
+        node = self.model.addChild(self.model.root, 'Trade {:05x}'.format(n), pst.NodeType.TRADE_PAGE, tradeUrl(n))
+        for i in range(self.matches):
+            self.model.onNewNode(node.id_, '[H] Wanted Game {}'.format(n * self.matches + i), pst.NodeType.H_GAME)
+    def requeue(self, n):
+        # the same as a trade page being queued again: the old node is replaced by a fresh one at the top
+        self.insert(n)
+    def updateIcon(self, n):
+        node = self.model.urls[tradeUrl(n)]
+        self.model.setIcon(node, self.icon)
+    def toggleBookmark(self, n):
+        url = tradeUrl(n)
+        for enabled in [url not in self.bookmarks, url in self.bookmarks]:
+            self.bookmarksModel.setBookmarked(url, enabled)
+            # the proxy maps rows lazily, a view asks for them right away
+            self.bookmarksModel.rowCount(QModelIndex())
+
+def traverse(model, parent, deadline):
+    # visits every index like a view would, fetching lazily populated children
+    count = 0
+    for row in range(model.rowCount(parent)):
+        if time.perf_counter() > deadline:
+            break
+        index = model.index(row, 0, parent)
+        model.data(index, Qt.DisplayRole)
+        model.data(index, Qt.DecorationRole)
+        model.data(index.siblingAtColumn(1), Qt.DisplayRole)
+        model.parent(index)
+        if model.canFetchMore(index):
+            model.fetchMore(index)
+        count += 1
+        if parent.isValid():
+            continue
+        count += traverse(model, index, deadline)
+    return count
+
+def check(size, matches, bookmarked):
+    # the testers re-check the whole tree on every change, so they get an untimed pass of their own
+    tree = Tree(size, matches, bookmarked, True)
+    for n in range(size):
+        tree.insert(n)
+    for n in range(0, size, 7):
+        tree.requeue(n)
+        tree.updateIcon(n)
+    traverse(tree.filterModel, QModelIndex(), time.perf_counter() + 3600)
+    for n in range(0, size, 5):
+        tree.toggleBookmark(n)
+    tree.model.searchIndex.setQuery('wanted game 1')
+    tree.filterModel.refilter()
+    tree.close()
+    print('{:<24} {:>6} trades: model tester passed'.format('check', size))
+
+def run(args):
+    app = QApplication(sys.argv)
+    rng = random.Random(0)
+    if args.check:
+        check(args.check, args.matches, args.bookmarked)
+    for size in args.sizes:
+        tree = Tree(size, args.matches, args.bookmarked)
+        report('insert', size, size, timed(range(size), tree.insert, args.budget))
+        size = tree.model.root.childCount()
+        start = time.perf_counter()
+        app.processEvents()
+        report('view layout', size, 1, (1, time.perf_counter() - start))
+        sample = [rng.randrange(size) for i in range(min(size, args.sample))]
+        report('requeue', size, len(sample), timed(sample, tree.requeue, args.budget))
+        report('icon update', size, len(sample), timed(sample, tree.updateIcon, args.budget))
+        for name, model in [('model', tree.model), ('filter proxy', tree.filterModel), ('bookmarks proxy', tree.bookmarksModel)]:
+            start = time.perf_counter()
+            done = traverse(model, QModelIndex(), start + args.budget)
+            expected = model.rowCount(QModelIndex()) * (args.matches + 1)
+            report('traverse ' + name, size, expected, (done, time.perf_counter() - start))
+        toggles = sample[:args.toggles]
+        report('bookmark toggle', size, len(toggles), timed(toggles, tree.toggleBookmark, args.budget))
+        start = time.perf_counter()
+        tree.model.searchIndex.setQuery('wanted game 1')
+        tree.filterModel.refilter()
+        tree.filterModel.rowCount(QModelIndex())
+        report('filter', size, 1, (1, time.perf_counter() - start))
+        tree.close()
+        app.processEvents()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Scaling benchmark for the PySteamTrades model layer')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [100, 1000, 10000, 50000], help = 'numbers of trades')
+    parser.add_argument('--matches', type = int, default = 3, help = 'match children per trade')
+    parser.add_argument('--bookmarked', type = float, default = 0.1, help = 'fraction of bookmarked trades')
+    parser.add_argument('--sample', type = int, default = 1000, help = 'requeues and icon updates per size')
+    parser.add_argument('--toggles', type = int, default = 100, help = 'bookmark toggles per size')
+    parser.add_argument('--budget', type = float, default = 60, help = 'seconds each operation may take per size')
+    parser.add_argument('--check', type = int, default = 200, help = "trades in the tree checked by Qt's model tester, 0 skips it")
+    run(parser.parse_args())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Drives refresh cycles of the main window, with message polls, searches and bookmarks, against the local
+# stand-in server and reports throughput, end-to-end latency, peak RSS of the main and web engine processes
+# and GUI event loop stalls
+
+import sys, os, argparse, time, logging
+from PySteamTrades import standin
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def peakRss():
+    try:
+        import resource
+    except ImportError:
+        return 'n/a'
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return '{:.1f} MB'.format(rss / 1024)
+
+def childrenRss():
+    # summed RSS in kB of all descendant processes, the QtWebEngineProcess renderers among them
+    if not os.path.isdir('/proc'):
+        return None
+    parents = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                # the command name in parentheses may contain spaces
+                parents[int(pid)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    descendants = []
+    pending = [os.getpid()]
+    while pending:
+        parent = pending.pop()
+        children = [pid for pid, ppid in parents.items() if ppid == parent]
+        descendants += children
+        pending += children
+    total = 0
+    for pid in descendants:
+        try:
+            with open('/proc/{}/status'.format(pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except (OSError, ValueError):
+            continue
+    return total
+
+def run(args, server):
+    # the site URL is read when main is imported
+    os.environ['PST_SITE_URL'] = server.url()
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QIcon
+    from PyQt5.QtCore import QTimer, QSettings
+    from PySteamTrades import main as pst
+
+    # settings and bookmarks of the load test are kept apart from the app's own
+    pst.orgName = 'PySteamTrades-loadtest'
+    app = QApplication(sys.argv)
+    QApplication.setQuitOnLastWindowClosed(False)
+    pst.baseDir = os.path.dirname(os.path.realpath(pst.__file__))
+    pst.readIcon = QIcon(pst.baseDir + '/read.ico')
+    pst.unreadIcon = QIcon(pst.baseDir + '/unread.ico')
+    dbPath = pst.bookmarksPath()
+    def cleanUp():
+        QSettings(pst.orgName, pst.appName).clear()
+        for path in [dbPath, dbPath + '-wal', dbPath + '-shm']:
+            if os.path.exists(path):
+                os.remove(path)
+    cleanUp()
+    s = QSettings(pst.orgName, pst.appName)
+    s.setValue('autosearch/enable', True)
+    s.setValue('autosearch/have_list', 'wanted game')
+    s.setValue('autosearch/want_list', 'wanted game')
+    s.setValue('autosearch/queries', '\n'.join('query {}'.format(n) for n in range(args.searches)))
+    # cycles are started here, not by the refresh timer
+    s.setValue('misc/interval', 24 * 60)
+    # bookmarks beyond the listed trades, in the old setting so they go through the migration
+    bookmarks = ['{}/trade/{:05x}/'.format(pst.siteUrl, args.pages + n) for n in range(args.bookmarks)]
+    s.setValue('bookmarks/bookmarks_list', '\n'.join(bookmarks))
+    s.sync()
+
+    monitor = pst.LagMonitor()
+    cycleTimer = QTimer()
+    cycleTimer.setSingleShot(True)
+    rssTimer = QTimer()
+    rssTimer.setInterval(500)
+    state = {'cycle': 1, 'start': time.perf_counter(), 'childrenRss': None, 'started': {}, 'latencies': [],\
+    'errors': 0, 'permalinks': 0}
+
+    def sampleRss():
+        rss = childrenRss()
+        if rss is not None:
+            state['childrenRss'] = max(state['childrenRss'] or 0, rss)
+    def startMeasuring():
+        state['start'] = time.perf_counter()
+        state['latencies'] = []
+        state['errors'] = 0
+        state['childrenRss'] = None
+        sampleRss()
+        rssTimer.start()
+        monitor.start()
+        cycleTimer.start(int(args.cycle_timeout * 1000))
+    def pageQueued(url):
+        state['started'][url] = time.perf_counter()
+    def pageDone(url, failed):
+        if url in state['started']:
+            state['latencies'].append((time.perf_counter() - state['started'].pop(url)) * 1000)
+        if failed:
+            state['errors'] += 1
+
+    # the first refresh starts with the window
+    startMeasuring()
+    window = pst.MainWindow()
+
+    def startCycle():
+        state['cycle'] += 1
+        window.model.invalidateAll()
+        startMeasuring()
+        window.refresh()
+    def finishCycle():
+        if not cycleTimer.isActive():
+            return
+        cycleTimer.stop()
+        rssTimer.stop()
+        sampleRss()
+        monitor.stop()
+        elapsed = time.perf_counter() - state['start']
+        pages = len(state['latencies'])
+        print('cycle {}: {} pages in {:.2f} s ({:.1f} pages/s), {} errors, {} still pending{}'.format(state['cycle'],\
+        pages, elapsed, pages / elapsed if elapsed else 0, state['errors'], len(state['started']),\
+        ', abandoned' if window.cycleRunning else ''))
+        print('  page latency ms: p50 {:.0f}, p90 {:.0f}, max {:.0f}'.format(percentile(state['latencies'], 50),\
+        percentile(state['latencies'], 90), max(state['latencies'], default = 0)))
+        lag = monitor.samples
+        print('  event loop lag ms: p99 {:.1f}, max {:.1f}, stalls over {} ms: {}'.format(percentile(lag, 99),\
+        max(lag, default = 0), args.stall, len([sample for sample in lag if sample > args.stall])))
+        checked = 'n/a'
+        if window.bookmarkStore:
+            checked = window.bookmarkStore.db.execute('SELECT COUNT(*) FROM bookmarks WHERE checked IS NOT NULL').fetchone()[0]
+        print('  bookmarks checked: {}/{}, new messages notified: {}'.format(checked, len(window.bookmarks),\
+        len(window.permalinks) - state['permalinks']))
+        state['permalinks'] = len(window.permalinks)
+        children = state['childrenRss']
+        print('  peak RSS: main process {}, child processes {} (sampled), server requests: {}'.format(peakRss(),\
+        'n/a' if children is None else '{:.1f} MB'.format(children / 1024), server.requests))
+        state['started'].clear()
+        if state['cycle'] < args.cycles:
+            QTimer.singleShot(0, startCycle)
+        else:
+            app.quit()
+
+    window.model.pageQueued.connect(pageQueued)
+    window.model.pageChecked.connect(lambda url, changed: pageDone(url, False))
+    window.model.pageFailed.connect(lambda url: pageDone(url, True))
+    window.cycleFinished.connect(finishCycle)
+    cycleTimer.timeout.connect(finishCycle)
+    rssTimer.timeout.connect(sampleRss)
+    app.exec_()
+    window.quit()
+    cleanUp()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'PySteamTrades load test against a local stand-in server')
+    standin.addArguments(parser)
+    parser.add_argument('--searches', type = int, default = 0, help = 'saved searches crawled besides the front page')
+    parser.add_argument('--bookmarks', type = int, default = 0, help = 'bookmarked trades checked besides the listed ones')
+    parser.add_argument('--cycles', type = int, default = 3, help = 'refresh cycles to run')
+    parser.add_argument('--cycle-timeout', type = float, default = 300, help = 'seconds before a cycle is abandoned')
+    parser.add_argument('--stall', type = float, default = 50, help = 'event loop lag in ms counted as a stall')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.WARNING)
+    server = standin.startServer(standin.configFromArgs(args), args.port)
+    print('Stand-in server on ' + server.url())
+    run(args, server)
+    server.shutdown()
@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 
-import sys, smtplib, ssl, keyring, os, logging, time, re, subprocess
+import sys, smtplib, ssl, keyring, os, logging, time, re, subprocess, threading, cProfile, pstats, tracemalloc, bisect, json, \
+random, math, sqlite3
 from enum import Enum
+from collections import deque
+from urllib.parse import quote_plus
 from bs4 import BeautifulSoup
 from PyQt5.QtWidgets import QApplication, QMainWindow, QSystemTrayIcon, QMenu, QAction, QDialog, QFileDialog, \
 QStyledItemDelegate, QProgressBar, QMessageBox
-from PyQt5.QtGui import QImage, QPixmap, QIcon, QColor, QTextCursor, QIntValidator
+from PyQt5.QtGui import QImage, QPixmap, QIcon, QColor, QFont, QTextCursor, QIntValidator
 from PyQt5.QtCore import Qt, QUrl, QTimer, QSettings, QObject, QRunnable, QThreadPool, QMutex, QMutexLocker, \
-QAbstractItemModel, QSortFilterProxyModel, QModelIndex, QSize, pyqtSignal
-from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
-from PyQt5.QtWebEngineWidgets import QWebEnginePage
+QAbstractItemModel, QSortFilterProxyModel, QModelIndex, QSize, QStandardPaths, pyqtSignal
+from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply, QNetworkCookieJar
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineProfile, QWebEngineSettings, QWebEngineScript
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
 from PySteamTrades.Ui_MainWindow import *
 from PySteamTrades.Ui_PrefsDialog import *
 from PySteamTrades.Ui_TestDialog import *
@@ -17,13 +21,49 @@ from PySteamTrades.Ui_TestDialog import *
 baseDir = None
 readIcon = None
 unreadIcon = None
+bgProfile = None
+bgInterceptor = None
+pagePool = None
+rateLimiter = None
+profiler = None
+# extract page data with a script inside the page instead of serializing it with toHtml
+scriptExtraction = True
 
 defaultInterval = 5
 defaultLevel = 2
 defaultLogfile = 'PySteamTrades.log'
 logFormat = '%(asctime)s - %(thread)d - %(levelname)s: %(message)s'
-stUrl = QUrl('https://www.steamtrades.com/')
-messagesUrl = QUrl('https://www.steamtrades.com/messages')
+# PST_SITE_URL points everything at another server, like the stand-in from PySteamTrades.standin
+siteUrl = os.environ.get('PST_SITE_URL', 'https://www.steamtrades.com').rstrip('/')
+stUrl = QUrl(siteUrl + '/')
+messagesUrl = QUrl(siteUrl + '/messages')
+searchUrl = siteUrl + '/trades/search'
+blankUrl = QUrl('about:blank')
+# seconds before a trade page is checked again, and before a failed one is retried
+defaultSearchTtl = 3600
+defaultBookmarkTtl = 3600
+defaultErrorTtl = 60
+maxErrorTtl = 3600
+
+stHosts = ['www.steamtrades.com', 'steamtrades.com', stUrl.host()]
+bgCacheSize = 50 * 1024 * 1024
+iconSize = QSize(40, 40)
+# requests per second to the site, adapted between the limits as errors and slow loads come and go
+defaultRate = 2.0
+minRate = 0.2
+maxRate = 10.0
+rateBurst = 5
+slowLoad = 15
+# retries of failed loads, with jittered exponential backoff in seconds
+maxRetries = 3
+retryDelay = 2
+maxRetryDelay = 60
+# background pages shared by workers, and how many loads before a page is replaced
+pagePoolSize = 6
+pageMaxUses = 50
+# bookmarks are kept in a database in the user's data directory, and queued for checks this many at a time
+bookmarksFile = 'bookmarks.db'
+bookmarkChunk = 50
 
 logLevels = [logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL]
 orgName = 'PySteamTrades'
@@ -41,6 +81,16 @@ New message from {author}:
 {message}
 """
 
+matchesTemplate = """\
+Subject: New matches on SteamTrades
+From: {sender}
+To: {recipient}
+
+Found {count} new match(es)
+
+{matches}
+"""
+
 testTemplate = """\
 Subject: PySteamTrades test message
 From: {sender}
@@ -49,7 +99,64 @@ To: {recipient}
 PySteamTrades test message
 """
 
-pattern = re.compile("https://www\.steamtrades\.com/trade/.{5}/")
+# The extraction scripts return the same data the BeautifulSoup parsers find, as JSON.
+# textContent matches BeautifulSoup's .text, innerText would depend on the blocked stylesheets
+tradeScript = """\
+(function() {
+    function text(selector) {
+        var e = document.querySelector(selector);
+        return e ? e.textContent : null;
+    }
+    var closed = document.querySelector('div.notification.yellow');
+    var avatar = document.querySelector('div.comment_inner a.author_avatar');
+    return JSON.stringify({
+        closed: !!closed && closed.textContent.indexOf('Closed') == 0,
+        title: text('div.page_heading h1'),
+        avatar: avatar ? avatar.getAttribute('style') : null,
+        have: text('div.have.markdown'),
+        want: text('div.want.markdown')
+    });
+})()
+"""
+
+searchScript = """\
+(function() {
+    var rows = document.querySelectorAll('div.row_inner_wrap');
+    return JSON.stringify(Array.prototype.map.call(rows, function(row) {
+        var link = row.querySelector('h3 a');
+        return {href: link ? link.getAttribute('href') : null, closed: !!row.querySelector('i.red.fa.fa-lock')};
+    }));
+})()
+"""
+
+messagesScript = """\
+(function() {
+    function text(parent, selector) {
+        var e = parent.querySelector(selector);
+        return e ? e.textContent : null;
+    }
+    var loggedIn = Array.prototype.some.call(document.querySelectorAll('span'), function(span) {
+        return span.attributes.length == 0 && span.firstChild && span.firstChild.nodeType == Node.TEXT_NODE
+            && span.firstChild.nodeValue.indexOf('Messages') == 0;
+    });
+    var comments = [];
+    Array.prototype.forEach.call(document.querySelectorAll('div.comment_inner'), function(comment) {
+        if (!comment.querySelector('div.comment_unread'))
+            return;
+        var links = comment.querySelectorAll('a');
+        comments.push({
+            author: text(comment, 'a.author_name'),
+            message: text(comment, 'div.comment_body_default.markdown'),
+            permalink: links.length ? links[links.length - 1].getAttribute('href') : null
+        });
+    });
+    return JSON.stringify({loggedIn: loggedIn, count: text(document, 'span.message_count'), comments: comments});
+})()
+"""
+
+pattern = re.compile(re.escape(siteUrl) + "/trade/.{5}/")
+tokenPattern = re.compile(r'\w+')
+messageCountPattern = re.compile(r'<span class="[^"]*message_count[^"]*"[^>]*>\s*([\d,]+)\s*</span>')
 def baseUrl(url):
     m = pattern.match(url)
     if m:
@@ -61,14 +168,261 @@ class NodeType(Enum):
     H_GAME = 2
     W_GAME = 3
 
+class BackgroundInterceptor(QWebEngineUrlRequestInterceptor):
+    # we only read the DOM of background pages, so anything that doesn't build it can go
+    blockedTypes = [QWebEngineUrlRequestInfo.ResourceTypeImage, QWebEngineUrlRequestInfo.ResourceTypeMedia,\
+    QWebEngineUrlRequestInfo.ResourceTypeFontResource, QWebEngineUrlRequestInfo.ResourceTypeStylesheet,\
+    QWebEngineUrlRequestInfo.ResourceTypeFavicon, QWebEngineUrlRequestInfo.ResourceTypeObject,\
+    QWebEngineUrlRequestInfo.ResourceTypePluginResource]
+    def interceptRequest(self, info):
+        if info.resourceType() in self.blockedTypes or info.requestUrl().host() not in stHosts:
+            info.block(True)
+
+def getBackgroundProfile():
+    global bgProfile, bgInterceptor
+    if not bgProfile:
+        bgProfile = QWebEngineProfile('background')
+        bgProfile.setHttpCacheType(QWebEngineProfile.DiskHttpCache)
+        bgProfile.setHttpCacheMaximumSize(bgCacheSize)
+        # cookies are copied from the default profile as they change
+        bgProfile.setPersistentCookiesPolicy(QWebEngineProfile.NoPersistentCookies)
+        settings = bgProfile.settings()
+        settings.setAttribute(QWebEngineSettings.AutoLoadImages, False)
+        settings.setAttribute(QWebEngineSettings.PluginsEnabled, False)
+        settings.setAttribute(QWebEngineSettings.WebGLEnabled, False)
+        settings.setAttribute(QWebEngineSettings.Accelerated2dCanvasEnabled, False)
+        bgInterceptor = BackgroundInterceptor(bgProfile)
+        if hasattr(bgProfile, 'setUrlRequestInterceptor'):
+            bgProfile.setUrlRequestInterceptor(bgInterceptor)
+        else:
+            bgProfile.setRequestInterceptor(bgInterceptor)
+    return bgProfile
+
+class PagePool(QObject):
+    def __init__(self, size = pagePoolSize, maxUses = pageMaxUses):
+        super().__init__()
+        self.maxUses = maxUses
+        self.free = []
+        self.resetting = set()
+        self.uses = {}
+        self.waiting = deque()
+        for i in range(size):
+            self.addPage()
+    def addPage(self):
+        page = QWebEnginePage(getBackgroundProfile(), self)
+        page.loadFinished.connect(lambda ok, self=self, page=page: self.pageReset(page, ok))
+        self.uses[page] = 0
+        self.reset(page)
+    def reset(self, page):
+        # pages are handed out only once about:blank has loaded, so no stale loadFinished reaches a worker
+        self.resetting.add(page)
+        page.setUrl(blankUrl)
+    def pageReset(self, page, ok):
+        # a stopped load may still report its failure after the reset started
+        if page not in self.resetting or not ok or page.requestedUrl() != blankUrl:
+            return
+        self.resetting.discard(page)
+        if self.waiting:
+            self.waiting.popleft()(page)
+        else:
+            self.free.append(page)
+    def acquire(self, callback):
+        if self.free:
+            callback(self.free.pop())
+        else:
+            self.waiting.append(callback)
+    def cancel(self, callback):
+        try:
+            self.waiting.remove(callback)
+        except ValueError:
+            pass
+    def release(self, page):
+        self.uses[page] += 1
+        if self.uses[page] >= self.maxUses:
+            # replace worn pages to contain renderer memory growth
+            del self.uses[page]
+            page.loadFinished.disconnect()
+            page.deleteLater()
+            self.addPage()
+            return
+        self.reset(page)
+
+class RateLimiter(QObject):
+    # token bucket shared by all site traffic
+    def __init__(self, rate = defaultRate, burst = rateBurst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lastDecrease = 0
+        self.waiting = deque()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.dispatch)
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+    def acquire(self, callback):
+        self.waiting.append(callback)
+        self.dispatch()
+    def cancel(self, callback):
+        try:
+            self.waiting.remove(callback)
+        except ValueError:
+            pass
+    def dispatch(self):
+        self.refill()
+        while self.waiting and self.tokens >= 1:
+            self.tokens -= 1
+            self.waiting.popleft()()
+        if self.waiting and not self.timer.isActive():
+            self.timer.start(math.ceil((1 - self.tokens) / self.rate * 1000))
+    def report(self, ok, latency):
+        # additive increase, multiplicative decrease at most once per backoff period
+        now = time.monotonic()
+        if not ok or latency > slowLoad:
+            if now - self.lastDecrease > retryDelay:
+                self.rate = max(minRate, self.rate / 2)
+                self.lastDecrease = now
+                logging.info('slowing down to {:.2f} requests/s'.format(self.rate))
+        elif self.rate < maxRate:
+            self.rate = min(maxRate, self.rate + 0.1)
+
+def getRateLimiter():
+    global rateLimiter
+    if not rateLimiter:
+        rateLimiter = RateLimiter()
+    return rateLimiter
+
+def backoffDelay(attempt):
+    delay = min(maxRetryDelay, retryDelay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def getPagePool():
+    global pagePool
+    if not pagePool:
+        pagePool = PagePool()
+    return pagePool
+
+class LagMonitor(QObject):
+    # samples how late a short timer fires, i.e. how long the event loop was blocked
+    def __init__(self, interval = 10):
+        super().__init__()
+        self.interval = interval
+        self.samples = []
+        self.last = 0
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+    def start(self):
+        self.samples = []
+        self.last = time.perf_counter()
+        self.timer.start(self.interval)
+    def stop(self):
+        self.timer.stop()
+    def tick(self):
+        now = time.perf_counter()
+        self.samples.append(max(0, (now - self.last) * 1000 - self.interval))
+        self.last = now
+
+class Profiler(QObject):
+    # opt-in profiling of refresh cycles, enabled by PST_PROFILE or the misc/profile setting
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.mutex = threading.Lock()
+        self.guiProfile = None
+        self.workerProfiles = []
+        self.snapshot = None
+        self.monitor = LagMonitor()
+        tracemalloc.start(5)
+    def startCycle(self):
+        self.finishCycle()
+        self.started = time.time()
+        self.guiProfile = cProfile.Profile()
+        try:
+            self.guiProfile.enable()
+        except ValueError as e:
+            logging.warning('Cannot profile the GUI thread: ' + str(e))
+            self.guiProfile = None
+        self.monitor.start()
+    def profile(self, func):
+        p = cProfile.Profile()
+        try:
+            p.enable()
+        except ValueError:
+            # since Python 3.12 only one profiler can be active, and the GUI profile already covers all threads
+            func()
+            return
+        try:
+            func()
+        finally:
+            p.disable()
+            with self.mutex:
+                self.workerProfiles.append(p)
+    def finishCycle(self):
+        if not self.monitor.timer.isActive():
+            return
+        self.monitor.stop()
+        if self.guiProfile:
+            self.guiProfile.disable()
+        with self.mutex:
+            workerProfiles = self.workerProfiles
+            self.workerProfiles = []
+        prefix = os.path.join(self.directory, 'PySteamTrades-profile-' + time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started)))
+        try:
+            if self.guiProfile:
+                pstats.Stats(self.guiProfile).dump_stats(prefix + '-gui.prof')
+            if workerProfiles:
+                pstats.Stats(*workerProfiles).dump_stats(prefix + '-workers.prof')
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            with open(prefix + '-memory.txt', 'w') as f:
+                if self.snapshot:
+                    f.write('Top allocation changes since the previous cycle\n')
+                    for stat in snapshot.compare_to(self.snapshot, 'lineno')[:50]:
+                        f.write(str(stat) + '\n')
+                else:
+                    f.write('Top allocations\n')
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        f.write(str(stat) + '\n')
+            self.snapshot = snapshot
+            samples = self.monitor.samples
+            with open(prefix + '-lag.txt', 'w') as f:
+                f.write('samples: {}, max: {:.1f} ms, over 50 ms: {}\n'.format(len(samples), max(samples, default = 0),\
+                len([sample for sample in samples if sample > 50])))
+                f.write('\n'.join('{:.1f}'.format(sample) for sample in samples))
+            logging.info('wrote profile ' + prefix)
+        except Exception as e:
+            logging.error('Error writing profile: ' + str(e))
+        self.guiProfile = None
+
 class Emitter(QObject):
     error = pyqtSignal(str, str)
     loadError = pyqtSignal(int)
     newNode = pyqtSignal(int, str, NodeType)
     updateName = pyqtSignal(int, str)
     updateIconUrl = pyqtSignal(int, str)
+    iconDecoded = pyqtSignal(str, QImage)
     finished = pyqtSignal(int)
 
+class IconDecoder(QRunnable):
+    # decodes and scales avatars off the GUI thread, which only has to wrap the small result in a QIcon
+    def __init__(self, url, data, size = iconSize):
+        super().__init__()
+        self.url = url
+        self.data = data
+        self.size = size
+        self.emitter = Emitter()
+    def run(self):
+        img = QImage()
+        if img.loadFromData(self.data):
+            img = img.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        else:
+            logging.warning('Cannot decode icon ' + self.url)
+        self.emitter.iconDecoded.emit(self.url, img)
+
 class MailSender(QRunnable):
     def __init__(self, sender, recipient, smtpServer, smtpPort, encryption,\
     username, password, message, permalink = '', debug = False):
@@ -177,6 +531,9 @@ class PrefsDialog(QDialog):
         self.ui.autoSearchGroupBox.setChecked(True if s.value('autosearch/enable', False, type=bool) else False)
         self.ui.haveTextEdit.setPlainText(s.value('autosearch/have_list', ''))
         self.ui.wantTextEdit.setPlainText(s.value('autosearch/want_list', ''))
+        self.ui.queriesTextEdit.setPlainText(s.value('autosearch/queries', ''))
+        self.ui.notifyMatchesCheckBox.setChecked(s.value('autosearch/notify', True, type=bool))
+        self.ui.emailMatchesCheckBox.setChecked(s.value('autosearch/email', False, type=bool))
     def selectFile(self):
         filename, _ = QFileDialog.getSaveFileName(self, 'Log file name', self.ui.logfileLineEdit.text(), "Log file (*.log);;All files(*.*)")
         if filename:
@@ -228,11 +585,15 @@ class PrefsDialog(QDialog):
 
         if s.value('autosearch/enable', False, type = bool) != self.ui.autoSearchGroupBox.isChecked()\
         or s.value('autosearch/have_list', '') != self.ui.haveTextEdit.toPlainText()\
-        or s.value('autosearch/want_list',  '') != self.ui.wantTextEdit.toPlainText():
+        or s.value('autosearch/want_list',  '') != self.ui.wantTextEdit.toPlainText()\
+        or s.value('autosearch/queries',  '') != self.ui.queriesTextEdit.toPlainText():
             s.setValue('autosearch/enable', self.ui.autoSearchGroupBox.isChecked())
             s.setValue('autosearch/have_list', self.ui.haveTextEdit.toPlainText())
             s.setValue('autosearch/want_list', self.ui.wantTextEdit.toPlainText())
+            s.setValue('autosearch/queries', self.ui.queriesTextEdit.toPlainText())
             self.autoSearchChanged.emit()
+        s.setValue('autosearch/notify', self.ui.notifyMatchesCheckBox.isChecked())
+        s.setValue('autosearch/email', self.ui.emailMatchesCheckBox.isChecked())
         super().accept()
 
 class Handler(QObject, logging.Handler):
@@ -253,6 +614,11 @@ class Node:
         self.icon = None
         self.children = []
         self.counter = 0
+        self.new = False
+        self.worker = None
+        # children exposed to views so far, the rest are handed out by Model.fetchMore
+        self.fetched = 0
+        self.populated = False
     def childCount(self):
         return len(self.children)
     def getChild(self, row):
@@ -283,8 +649,157 @@ class Node:
     def ids(self):
         return [child.id_ for child in self.children]
 
+class CacheSource(Enum):
+    SEARCH = 1
+    BOOKMARK = 2
+
+class CacheEntry:
+    def __init__(self):
+        self.expires = 0
+        self.failures = 0
+
+class ExpiringCache:
+    def __init__(self, ttls = {}, errorTtl = defaultErrorTtl, maxErrorTtl = maxErrorTtl):
+        self.ttls = dict(ttls)
+        self.errorTtl = errorTtl
+        self.maxErrorTtl = maxErrorTtl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+    def setTtl(self, source, ttl):
+        self.ttls[source] = ttl
+    def isFresh(self, key):
+        entry = self.entries.get(key)
+        if entry and time.time() < entry.expires:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+    def add(self, key, source):
+        entry = self.entries.setdefault(key, CacheEntry())
+        entry.expires = time.time() + self.ttls.get(source, defaultSearchTtl)
+    def succeeded(self, key):
+        entry = self.entries.get(key)
+        if entry:
+            entry.failures = 0
+    def failed(self, key):
+        entry = self.entries.setdefault(key, CacheEntry())
+        # back off exponentially for pages that keep failing
+        entry.failures += 1
+        ttl = min(self.errorTtl * 2 ** (entry.failures - 1), self.maxErrorTtl)
+        entry.expires = time.time() + ttl
+    def purge(self):
+        now = time.time()
+        # keep the backoff state of failing pages for a while after they expire
+        expired = [key for key, entry in self.entries.items()\
+        if entry.expires + (self.maxErrorTtl if entry.failures else 0) <= now]
+        for key in expired:
+            del self.entries[key]
+        return len(expired)
+    def clear(self):
+        self.entries.clear()
+    def stats(self):
+        return 'entries: {}, hits: {}, misses: {}'.format(len(self.entries), self.hits, self.misses)
+
+class MatchDelta:
+    # (trade URL, match line) pairs seen so far, and the ones first seen in the current cycle.
+    # The first cycle after launch only learns the matches that are already there
+    def __init__(self):
+        self.seen = set()
+        self.new = []
+        self.seeding = True
+    def add(self, url, line):
+        key = (url, line)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        if self.seeding:
+            return False
+        self.new.append(key)
+        return True
+    def takeNew(self):
+        self.seeding = False
+        new = self.new
+        self.new = []
+        return new
+
+class SearchIndex:
+    # inverted index from title and match tokens to trade node ids, with the results of the current query
+    def __init__(self):
+        self.postings = {}
+        self.tokens = {}
+        self.vocabulary = []
+        self.dirty = False
+        self.query = []
+        self.results = None
+    def tokenize(self, text):
+        return tokenPattern.findall(text.lower())
+    def add(self, id_, text):
+        nodeTokens = self.tokens.setdefault(id_, set())
+        for token in self.tokenize(text):
+            if token not in self.postings:
+                self.postings[token] = set()
+                self.dirty = True
+            self.postings[token].add(id_)
+            nodeTokens.add(token)
+        self.check(id_)
+    def remove(self, id_):
+        for token in self.tokens.pop(id_, []):
+            ids = self.postings[token]
+            ids.discard(id_)
+            if not ids:
+                del self.postings[token]
+                self.dirty = True
+        if self.results is not None:
+            self.results.discard(id_)
+    def update(self, node):
+        self.remove(node.id_)
+        # trade pages are named after their URL until the title is known
+        if node.name != node.url:
+            self.add(node.id_, node.name)
+        for child in node.children:
+            self.add(node.id_, child.name)
+        self.check(node.id_)
+    def check(self, id_):
+        if self.results is None:
+            return
+        nodeTokens = self.tokens.get(id_, ())
+        if all(any(token.startswith(q) for token in nodeTokens) for q in self.query):
+            self.results.add(id_)
+        else:
+            self.results.discard(id_)
+    def lookup(self, prefix):
+        if self.dirty:
+            self.vocabulary = sorted(self.postings.keys())
+            self.dirty = False
+        ids = set()
+        i = bisect.bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            ids |= self.postings[self.vocabulary[i]]
+            i += 1
+        return ids
+    def setQuery(self, text):
+        self.query = self.tokenize(text)
+        if not self.query:
+            self.results = None
+            return
+        # every query token matches as a prefix, so results update while typing
+        results = None
+        for q in sorted(self.query, key = len, reverse = True):
+            ids = self.lookup(q)
+            results = ids if results is None else results & ids
+            if not results:
+                break
+        self.results = results
+    def accepts(self, id_):
+        return self.results is None or id_ in self.results
+
 class Model(QAbstractItemModel):
     statusMessage = pyqtSignal(str)
+    newMatches = pyqtSignal(list)
+    pageQueued = pyqtSignal(str)
+    pageChecked = pyqtSignal(str, bool)
+    pageFailed = pyqtSignal(str)
     progress = pyqtSignal(int)
     cancelAll = pyqtSignal()
     def __init__(self, haveList = [], wantList = []):
@@ -295,13 +810,42 @@ class Model(QAbstractItemModel):
         self.wantList = wantList
         self.queued = 0
         self.processed = 0
-        self.timestamps = {}
+        self.cache = ExpiringCache({CacheSource.SEARCH: defaultSearchTtl, CacheSource.BOOKMARK: defaultBookmarkTtl})
         self.urls = {}
         self.ids = {}
+        self.searchIndex = SearchIndex()
+        self.delta = MatchDelta()
+        self.highlighted = []
+        self.newFont = QFont()
+        self.newFont.setBold(True)
+        # decoded avatars by URL, shared by all trades of the same trader, and nodes waiting for a download
+        self.icons = {}
+        self.iconWaiting = {}
     def rowCount(self, index):
         if index.isValid():
-            return index.internalPointer().childCount()
+            # only the first column has children
+            if index.column() > 0:
+                return 0
+            return index.internalPointer().fetched
         return self.root.childCount()
+    def hasChildren(self, index = QModelIndex()):
+        if index.isValid():
+            return index.column() == 0 and index.internalPointer().childCount() > 0
+        return self.root.childCount() > 0
+    def canFetchMore(self, index):
+        if not index.isValid() or index.column() > 0:
+            return False
+        node = index.internalPointer()
+        return node.childCount() > 0 and (not node.populated or node.fetched < node.childCount())
+    def fetchMore(self, index):
+        if not index.isValid():
+            return
+        node = index.internalPointer()
+        node.populated = True
+        if node.fetched < node.childCount():
+            self.beginInsertRows(index, node.fetched, node.childCount() - 1)
+            node.fetched = node.childCount()
+            self.endInsertRows()
     def columnCount(self, index):
         return 2
     def index(self, row, column, parentIndex = None):
@@ -334,6 +878,9 @@ class Model(QAbstractItemModel):
         if role == Qt.DecorationRole:
             if index.column() == 0:
                 return node.icon
+        if role == Qt.FontRole:
+            if node.new:
+                return self.newFont
         if role == Qt.BackgroundRole:
             if node.type_ == NodeType.H_GAME:
                 return QColor(0xFF, 0xCC, 0xCB)
@@ -344,19 +891,32 @@ class Model(QAbstractItemModel):
             parentIndex = QModelIndex()
             if url in self.urls.keys():
                 node = self.urls[url]
+                if node.worker:
+                    self.retireWorker(node)
                 self.beginRemoveRows(parentIndex, node.getRow(), node.getRow())
                 self.root.removeChild(node.getRow())
                 self.urls.pop(url)
                 self.ids.pop(node.id_)
+                self.searchIndex.remove(node.id_)
                 self.endRemoveRows()
             self.beginInsertRows(parentIndex, 0, 0)
+        elif parent.childCount() > 0 and not parent.populated:
+            # the parent was never expanded, keep the child until the view asks for it
+            node = parent.addChild(name, type_, url)
+            self.searchIndex.add(parent.id_, name)
+            return node
         else:
+            # the first child is always inserted so views show the parent as expandable
             parentIndex = self.createIndex(parent.getRow(), 0, parent)
             self.beginInsertRows(parentIndex, parent.childCount(), parent.childCount())
         node = parent.addChild(name, type_, url)
         if parent == self.root:
             self.urls[url] = node
             self.ids[node.id_] = node
+            self.searchIndex.update(node)
+        else:
+            parent.fetched = parent.childCount()
+            self.searchIndex.add(parent.id_, name)
         self.endInsertRows()
         if iconUrl:
             self.onUpdateIconUrl(node.id_, iconUrl)
@@ -367,59 +927,122 @@ class Model(QAbstractItemModel):
         node = self.ids[id_]
         if node.name != newName:
             node.name = newName
-            index = self.createIndex(node.getRow(), 0, node)
-            self.dataChanged.emit(index, index)
+            self.searchIndex.update(node)
+            self.nodeChanged(node)
     def onUpdateIconUrl(self, id_, newUrl):
         if id_ not in self.ids.keys() or not newUrl:
             return
         node = self.ids[id_]
-        if node.iconUrl != newUrl:
-            node.iconUrl = newUrl
-            request = QNetworkRequest(QUrl(newUrl))
-            reply = self.nam.get(request)
-            reply.finished.connect(lambda self=self, id_=id_: self.onUpdateIcon(id_, self.sender()))
-    def onUpdateIcon(self, id_, reply):
-        if id_ not in self.ids.keys():
+        if node.iconUrl == newUrl:
             return
+        node.iconUrl = newUrl
+        if newUrl in self.icons:
+            self.setIcon(node, self.icons[newUrl])
+        elif newUrl in self.iconWaiting:
+            self.iconWaiting[newUrl].append(id_)
+        else:
+            self.iconWaiting[newUrl] = [id_]
+            getRateLimiter().acquire(lambda self=self, url=newUrl: self.downloadIcon(url))
+    def downloadIcon(self, url):
+        request = QNetworkRequest(QUrl(url))
+        reply = self.nam.get(request)
+        reply.finished.connect(lambda self=self, url=url, reply=reply: self.onUpdateIcon(url, reply))
+    def onUpdateIcon(self, url, reply):
+        reply.deleteLater()
         if reply.error() != QNetworkReply.NoError:
-            logging.warning("Error downloading icon {}: {}".format(\
-            reply.request().url().toString(), reply.errorString()))
+            logging.warning("Error downloading icon {}: {}".format(url, reply.errorString()))
+            self.iconWaiting.pop(url, None)
+            return
+        decoder = IconDecoder(url, bytes(reply.readAll()))
+        decoder.emitter.iconDecoded.connect(self.onIconDecoded)
+        QThreadPool.globalInstance().start(decoder)
+    def onIconDecoded(self, url, img):
+        ids = self.iconWaiting.pop(url, [])
+        if img.isNull():
             return
         try:
-            node = self.ids[id_]
-            img = QImage()
-            img.loadFromData(reply.readAll())
             icon = QIcon(QPixmap.fromImage(img))
-            node.icon = icon
-            index = self.createIndex(node.getRow(), 0, node)
-            self.dataChanged.emit(index, index)
+            self.icons[url] = icon
+            for id_ in ids:
+                node = self.ids.get(id_)
+                if node and node.iconUrl == url:
+                    self.setIcon(node, icon)
         except Exception as e:
             logging.error('Error setting icon: ' + str(e))
+    def setIcon(self, node, icon):
+        node.icon = icon
+        self.nodeChanged(node)
+    def nodeChanged(self, node):
+        index = self.createIndex(node.getRow(), 0, node)
+        self.dataChanged.emit(index, index)
     def onNewNode(self, parentId, name, type_):
         if parentId not in self.ids.keys():
             return
         parent = self.ids[parentId]
-        self.addChild(parent, name, type_)
-    def parseSearchResults(self, html):
+        node = self.addChild(parent, name, type_)
+        if self.delta.add(parent.url, name):
+            self.highlight(node)
+            if not parent.new:
+                self.highlight(parent)
+                index = self.createIndex(parent.getRow(), 0, parent)
+                self.dataChanged.emit(index, index)
+    def reportMatches(self):
+        # called once a refresh has checked everything it queued
+        new = self.delta.takeNew()
+        if new:
+            self.newMatches.emit([(self.urls[url].name if url in self.urls else url, url, line) for url, line in new])
+    def highlight(self, node):
+        node.new = True
+        self.highlighted.append(node)
+    def clearHighlights(self):
+        # only the nodes highlighted in the last cycle need updating
+        for node in self.highlighted:
+            node.new = False
+            trade = node if node.parent == self.root else node.parent
+            if self.ids.get(trade.id_) is not trade:
+                # replaced since
+                continue
+            row = node.getRow()
+            if node != trade and row >= trade.fetched:
+                continue
+            index = self.createIndex(row, 0, node)
+            self.dataChanged.emit(index, index)
+        self.highlighted = []
+    def searchResultRows(self, html):
+        rows = []
         try:
             soup = BeautifulSoup(html, 'html.parser')
 
-            trades = soup.find_all('div', attrs={'class': 'row_inner_wrap'})
-            counter = 0
-            for trade in reversed(trades):
-                if trade.find('i', attrs={'class': 'red fa fa-lock'}):
-                    # Closed trade page
-                    continue
-                url = 'https://www.steamtrades.com' + trade.find('h3').find('a')['href']
-                if self.queueUrl(url, False):
-                    counter += 1
-            if counter > 0:
-                self.statusMessage.emit('Queued {} pages'.format(counter))
+            for trade in soup.find_all('div', attrs={'class': 'row_inner_wrap'}):
+                heading = trade.find('h3')
+                link = heading.find('a') if heading else None
+                rows.append({'href': link.get('href') if link else None,\
+                'closed': trade.find('i', attrs={'class': 'red fa fa-lock'}) is not None})
         except Exception as e:
             logging.error('Error parsing search results: ' + str(e))
-    def queueUrl(self, url, force, title = '', iconUrl = ''):
+        return rows
+    def searchResultUrls(self, rows):
+        urls = []
+        for row in reversed(rows):
+            if row['closed'] or not row['href']:
+                # Closed trade page
+                continue
+            url = baseUrl(siteUrl + row['href'])
+            if url:
+                urls.append(url)
+        return urls
+    def queueSearchResults(self, rows):
+        counter = 0
+        for url in self.searchResultUrls(rows):
+            if self.queueUrl(url, False):
+                counter += 1
+        if counter > 0:
+            self.statusMessage.emit('Queued {} pages'.format(counter))
+    def parseSearchResults(self, html):
+        self.queueSearchResults(self.searchResultRows(html))
+    def queueUrl(self, url, force, title = '', iconUrl = '', source = CacheSource.SEARCH):
         url = baseUrl(url)
-        if not force and url in self.timestamps.keys() and time.time() < self.timestamps[url] + 3600:
+        if not force and self.cache.isFresh(url):
             return False
         if not title:
             title = url
@@ -432,8 +1055,10 @@ class Model(QAbstractItemModel):
         w.emitter.loadError.connect(self.workerError)
         w.emitter.finished.connect(self.workerFinished)
         self.cancelAll.connect(w.cancel)
-        self.timestamps[url] = time.time()
+        node.failed = False
+        self.cache.add(url, source)
         self.queued += 1
+        self.pageQueued.emit(url)
         logging.debug('Queued URL: ' + url)
         return True
     def workerFinished(self, id_):
@@ -445,6 +1070,16 @@ class Model(QAbstractItemModel):
             logging.error("workerFinished() called more than once for {}".format(node.url))
             return
         node.worker = None
+        if not node.failed:
+            self.cache.succeeded(node.url)
+            # the trade node is highlighted when the check found new matches
+            self.pageChecked.emit(node.url, node.new)
+        else:
+            self.pageFailed.emit(node.url)
+        if self.searchIndex.results is not None:
+            # let filter proxies check the trade again now that all its matches are in
+            index = self.createIndex(node.getRow(), 0, node)
+            self.dataChanged.emit(index, index)
         self.processed += 1
         if self.processed == self.queued:
             self.queued = 0
@@ -454,17 +1089,28 @@ class Model(QAbstractItemModel):
             logging.error("invalid value of queued workers")
         else:
             self.progress.emit(int(self.processed * 100 / self.queued))
+    def retireWorker(self, node):
+        # the page was queued again before its check finished, the old worker is dropped and counted as processed
+        worker = node.worker
+        node.worker = None
+        worker.emitter.disconnect()
+        worker.cancel()
+        self.processed += 1
     def workerError(self, id_):
         if id_ not in self.ids.keys():
             return
         self.onUpdateName(id_, "Error loading page")
         node = self.ids[id_]
-        self.timestamps[node.url] = 0
+        node.failed = True
+        self.cache.failed(node.url)
     def checkNow(self, url):
         self.queueUrl(url, True)
+    def purgeCache(self):
+        purged = self.cache.purge()
+        logging.debug('purged {} expired cache entries ({})'.format(purged, self.cache.stats()))
     def invalidateAll(self):
-        # clear timestamps to invalidate the current search results
-        self.timestamps.clear()
+        # clear the cache to invalidate the current search results
+        self.cache.clear()
     def updateLists(self, haveList, wantList):
         self.haveList = haveList
         self.wantList = wantList
@@ -485,29 +1131,73 @@ class Worker(QRunnable):
         self.state = WorkerState.PENDING
         self.mutex = QMutex()
         self.emitter = Emitter()
-        self.page = QWebEnginePage()
+        self.page = None
         self.html = ''
+        self.data = None
+        self.attempts = 0
+        self.loadStarted = 0
+        getPagePool().acquire(self.start)
+    def start(self, page):
+        if self.state != WorkerState.PENDING:
+            # canceled while waiting for a page
+            getPagePool().release(page)
+            return
+        self.page = page
         self.page.loadFinished.connect(self.loadFinished)
+        if self.attempts == 0:
+            # Set timeout to 3 minutes
+            QTimer.singleShot(3 * 60 * 1000, self.cancel)
+        getRateLimiter().acquire(self.load)
+    def load(self):
+        if self.state != WorkerState.PENDING or not self.page:
+            return
+        self.loadStarted = time.monotonic()
         self.page.setUrl(QUrl(self.url))
-        # Set timeout to 3 minutes
-        QTimer.singleShot(3 * 60 * 1000, self.cancel)
+    def releasePage(self):
+        if self.page:
+            self.page.loadFinished.disconnect(self.loadFinished)
+            getPagePool().release(self.page)
+            self.page = None
     def changeState(self, new, old = None):
         mutexLocker = QMutexLocker(self.mutex)
         if not old or old == self.state:
             self.state = new
             return True
     def run(self):
+        if profiler:
+            profiler.profile(self.parse)
+        else:
+            self.parse()
+    def extract(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        data = {}
+        closedTag = soup.find('div', attrs={'class': 'notification yellow'})
+        data['closed'] = bool(closedTag and closedTag.text.startswith('Closed'))
+        heading = soup.find('div', attrs={'class': 'page_heading'})
+        data['title'] = heading.find('h1').text if heading and heading.find('h1') else None
+        comment = soup.find('div', attrs={'class': 'comment_inner'})
+        avatar = comment.find('a', attrs={'class': 'author_avatar'}) if comment else None
+        data['avatar'] = avatar['style'] if avatar else None
+        h = soup.find('div', attrs={'class': 'have markdown'})
+        data['have'] = h.text if h else None
+        h = soup.find('div', attrs={'class': 'want markdown'})
+        data['want'] = h.text if h else None
+        return data
+    def parse(self):
         if not self.changeState(WorkerState.RUNNING, WorkerState.PENDING):
             return
         try:
-            soup = BeautifulSoup(self.html, 'html.parser')
-            closedTag = soup.find('div', attrs={'class': 'notification yellow'})
-            if closedTag and closedTag.text.startswith('Closed'):
+            data = self.data if self.data is not None else self.extract(self.html)
+            if data['closed']:
                 title = 'Closed'
+            elif data['title'] is not None:
+                title = data['title']
             else:
-                title = soup.find('div', attrs={'class': 'page_heading'}).find('h1').text
-            style = soup.find('div', attrs={'class': 'comment_inner'}).find('a', attrs={'class': 'author_avatar'})['style']
-            res = re.findall('url\((.*)\);', style)
+                raise ValueError('page heading not found')
+            style = data['avatar']
+            if style is None:
+                raise ValueError('author avatar not found')
+            res = re.findall(r'url\((.*)\);', style)
             if len(res) == 1:
                 iconUrl = res[0]
             else:
@@ -515,16 +1205,14 @@ class Worker(QRunnable):
             self.emitter.updateName.emit(self.id_, title)
             self.emitter.updateIconUrl.emit(self.id_, iconUrl)
 
-            h = soup.find('div', attrs={'class': 'have markdown'})
-            if h:
-                hls = h.text.split('\n')
+            if data['have'] is not None:
+                hls = data['have'].split('\n')
                 for g in self.wantList:
                     for hl in hls:
                         if g in hl.lower():
                             self.emitter.newNode.emit(self.id_, '[H] ' + hl, NodeType.H_GAME)
-            h = soup.find('div', attrs={'class': 'want markdown'})
-            if h:
-                hls = h.text.split('\n')
+            if data['want'] is not None:
+                hls = data['want'].split('\n')
                 for g in self.haveList:
                     for hl in hls:
                         if g in hl.lower():
@@ -534,47 +1222,296 @@ class Worker(QRunnable):
         self.changeState(WorkerState.FINISHED)
         self.emitter.finished.emit(self.id_)
     def loadFinished(self, ok):
+        if self.state != WorkerState.PENDING:
+            # canceled, the page was already released
+            return
+        if self.page.requestedUrl() != QUrl(self.url):
+            # left over from an earlier load of the page
+            return
+        getRateLimiter().report(ok, time.monotonic() - self.loadStarted)
+        if not ok and self.attempts < maxRetries:
+            self.releasePage()
+            self.attempts += 1
+            delay = backoffDelay(self.attempts)
+            logging.info('Failed to load page {}, retrying in {:.1f} s'.format(self.url, delay))
+            QTimer.singleShot(int(delay * 1000), lambda self=self: getPagePool().acquire(self.start))
+            return
         if not ok:
             logging.warning('Failed to load page: ' + self.url)
+            self.releasePage()
             self.changeState(WorkerState.FINISHED)
             self.emitter.loadError.emit(self.id_)
             self.emitter.finished.emit(self.id_)
             return
-        self.page.toHtml(self.processPage)
+        if scriptExtraction:
+            self.page.runJavaScript(tradeScript, QWebEngineScript.ApplicationWorld, self.processData)
+        else:
+            self.page.toHtml(self.processPage)
+    def processData(self, result):
+        try:
+            self.data = json.loads(result)
+        except Exception as e:
+            if self.page:
+                logging.warning('Script extraction failed for {}, using HTML: {}'.format(self.url, str(e)))
+                self.page.toHtml(self.processPage)
+            return
+        self.releasePage()
+        QThreadPool.globalInstance().start(self)
     def processPage(self, html):
+        self.releasePage()
         self.html = html
         QThreadPool.globalInstance().start(self)
     def cancel(self):
         if not self.changeState(WorkerState.FINISHED, WorkerState.PENDING):
             return
-        self.page.triggerAction(QWebEnginePage.Stop)
+        getRateLimiter().cancel(self.load)
+        if self.page:
+            self.page.triggerAction(QWebEnginePage.Stop)
+            self.releasePage()
+        else:
+            getPagePool().cancel(self.start)
         logging.warning('Canceling ' + self.url)
         self.emitter.loadError.emit(self.id_)
         self.emitter.finished.emit(self.id_)
 
-class BookmarksModel(QSortFilterProxyModel):
-    def __init__(self, urls):
+def queryUrl(query):
+    if query.startswith('http://') or query.startswith('https://'):
+        return QUrl(query)
+    return QUrl(searchUrl + '?q=' + quote_plus(query))
+
+class Search:
+    # one search page, from waiting for a pooled page until its results are queued
+    def __init__(self, url):
+        self.url = url
+        self.attempts = 0
+        self.page = None
+        self.handler = None
+        self.acquired = None
+        self.ready = None
+        self.state = WorkerState.PENDING
+
+class SearchCrawler(QObject):
+    # loads the front page and the saved searches through the page pool, so they share its budget with workers
+    statusMessage = pyqtSignal(str)
+    finished = pyqtSignal()
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.queries = []
+        self.pending = []
+        self.found = set()
+        self.queued = 0
+        model.cancelAll.connect(self.cancelAll)
+    def setQueries(self, queries):
+        self.queries = [queryUrl(query) for query in queries]
+    def crawl(self):
+        if self.pending:
+            logging.warning('Previous search still running, skipping')
+            return
+        self.found = set()
+        self.queued = 0
+        self.pending = [Search(url) for url in [stUrl] + self.queries]
+        for search in list(self.pending):
+            self.fetch(search)
+    def fetch(self, search):
+        if search.state != WorkerState.PENDING:
+            return
+        search.acquired = lambda page, self=self, search=search: self.start(search, page)
+        getPagePool().acquire(search.acquired)
+    def start(self, search, page):
+        search.acquired = None
+        if search.state != WorkerState.PENDING:
+            getPagePool().release(page)
+            return
+        search.page = page
+        if search.attempts == 0:
+            # Set timeout to 3 minutes, from when the search gets a page like a Worker
+            QTimer.singleShot(3 * 60 * 1000, lambda self=self, search=search: self.cancel(search))
+        search.ready = lambda self=self, search=search: self.load(search)
+        getRateLimiter().acquire(search.ready)
+    def load(self, search):
+        search.ready = None
+        if search.state != WorkerState.PENDING or not search.page:
+            return
+        search.handler = lambda ok, self=self, search=search, started=time.monotonic():\
+        self.loaded(search, ok, time.monotonic() - started)
+        search.page.loadFinished.connect(search.handler)
+        search.page.setUrl(search.url)
+    def releasePage(self, search):
+        if search.handler:
+            search.page.loadFinished.disconnect(search.handler)
+            search.handler = None
+        if search.page:
+            getPagePool().release(search.page)
+            search.page = None
+    def loaded(self, search, ok, latency):
+        if search.page.requestedUrl() != search.url:
+            # left over from an earlier load of the page
+            return
+        search.page.loadFinished.disconnect(search.handler)
+        search.handler = None
+        getRateLimiter().report(ok, latency)
+        if not ok:
+            self.releasePage(search)
+            if search.attempts < maxRetries:
+                search.attempts += 1
+                delay = backoffDelay(search.attempts)
+                logging.info('Failed to load URL {}, retrying in {:.1f} s'.format(search.url.toString(), delay))
+                QTimer.singleShot(int(delay * 1000), lambda self=self, search=search: self.fetch(search))
+                return
+            logging.warning('Failed to load URL: ' + search.url.toString())
+            self.done(search)
+            return
+        if scriptExtraction:
+            search.page.runJavaScript(searchScript, QWebEngineScript.ApplicationWorld,\
+            lambda result, self=self, search=search: self.extracted(search, result))
+        else:
+            search.page.toHtml(lambda html, self=self, search=search: self.parsed(search, self.model.searchResultRows(html)))
+    def extracted(self, search, result):
+        if search.state != WorkerState.PENDING:
+            return
+        try:
+            rows = json.loads(result)
+        except Exception as e:
+            logging.warning('Script extraction failed for {}, using HTML: {}'.format(search.url.toString(), str(e)))
+            search.page.toHtml(lambda html, self=self, search=search: self.parsed(search, self.model.searchResultRows(html)))
+            return
+        self.parsed(search, rows)
+    def parsed(self, search, rows):
+        if search.state != WorkerState.PENDING:
+            # canceled, the page was already released
+            return
+        self.releasePage(search)
+        for url in self.model.searchResultUrls(rows):
+            # trades listed by several searches are only queued once
+            if url in self.found:
+                continue
+            self.found.add(url)
+            if self.model.queueUrl(url, False):
+                self.queued += 1
+        self.done(search)
+    def cancel(self, search):
+        if search.state != WorkerState.PENDING:
+            return
+        if search.acquired:
+            getPagePool().cancel(search.acquired)
+        if search.ready:
+            getRateLimiter().cancel(search.ready)
+        if search.page:
+            search.page.triggerAction(QWebEnginePage.Stop)
+            self.releasePage(search)
+        logging.warning('Canceling search ' + search.url.toString())
+        self.done(search)
+    def cancelAll(self):
+        for search in list(self.pending):
+            self.cancel(search)
+    def done(self, search):
+        search.state = WorkerState.FINISHED
+        self.pending.remove(search)
+        if self.pending:
+            return
+        logging.debug('{} searches listed {} trades'.format(len(self.queries) + 1, len(self.found)))
+        if self.queued > 0:
+            self.statusMessage.emit('Queued {} pages'.format(self.queued))
+        self.finished.emit()
+
+class FilterModel(QSortFilterProxyModel):
+    def __init__(self, searchIndex):
         super().__init__()
+        self.searchIndex = searchIndex
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        # match nodes are shown with their trade page
+        if sourceParent.isValid():
+            return True
+        node = self.sourceModel().root.getChild(sourceRow)
+        return node is not None and self.searchIndex.accepts(node.id_)
+    def refilter(self):
+        self.invalidateFilter()
+
+class BookmarksModel(FilterModel):
+    def __init__(self, urls, searchIndex):
+        super().__init__(searchIndex)
         self.bookmarkedUrls = urls
     def filterAcceptsRow(self, sourceRow, sourceParent):
-        urlIndex = self.sourceModel().index(sourceRow, 1, sourceParent)
-        url = self.sourceModel().data(urlIndex, role = Qt.DisplayRole)
-        # Only trade pages have URLs. Game nodes are always shown
-        if not url or url in self.bookmarkedUrls:
+        if not super().filterAcceptsRow(sourceRow, sourceParent):
+            return False
+        # Game nodes are always shown
+        if sourceParent.isValid():
             return True
-        return False
+        node = self.sourceModel().root.getChild(sourceRow)
+        return not node.url or node.url in self.bookmarkedUrls
+    def setBookmarked(self, url, enabled):
+        if enabled:
+            self.bookmarkedUrls.add(url)
+        else:
+            self.bookmarkedUrls.discard(url)
+        # the dynamic filter re-checks just the changed row
+        node = self.sourceModel().urls.get(url)
+        if node:
+            self.sourceModel().nodeChanged(node)
+
+def sourceNode(index):
+    model = index.model()
+    if isinstance(model, QSortFilterProxyModel):
+        index = model.mapToSource(index)
+    return index.internalPointer()
 
 class ItemDelegate(QStyledItemDelegate):
+    def __init__(self):
+        super().__init__()
+        self.sizes = {}
     def sizeHint(self, option, index):
-        size = super().sizeHint(option, index)
-        if index.isValid():
-            urlIndex = index.siblingAtColumn(1)
-            if urlIndex and urlIndex.isValid() and urlIndex.data(Qt.DisplayRole):
-                return size * 1.2
+        if not index.isValid():
+            return super().sizeHint(option, index)
+        # row height only depends on the node type and the font, so compute it once per combination
+        type_ = sourceNode(index).type_
+        key = (type_, option.fontMetrics.height(), option.decorationSize.height())
+        size = self.sizes.get(key)
+        if not size:
+            size = super().sizeHint(option, index)
+            if type_ == NodeType.TRADE_PAGE:
+                # leave room for the avatar even if it's not downloaded yet
+                size.setHeight(max(size.height(), option.decorationSize.height()))
+                size = size * 1.2
+            self.sizes[key] = size
         return size
 
+class BookmarkStore:
+    # one row per bookmarked trade URL with when it was added, last checked and last found with new matches
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        # with WAL a commit only waits for a sync at checkpoints
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS bookmarks (url TEXT PRIMARY KEY, added REAL, checked REAL, changed REAL)')
+        self.db.commit()
+    def urls(self):
+        # least recently checked first
+        return [row[0] for row in self.db.execute('SELECT url FROM bookmarks ORDER BY checked IS NOT NULL, checked, added')]
+    def add(self, urls):
+        before = self.db.total_changes
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO bookmarks (url, added) VALUES (?, ?)', [(url, time.time()) for url in urls])
+        return self.db.total_changes - before
+    def remove(self, url):
+        with self.db:
+            self.db.execute('DELETE FROM bookmarks WHERE url = ?', (url,))
+    def checked(self, updates):
+        # (url, time, changed) of each checked bookmark, written in one transaction
+        with self.db:
+            self.db.executemany('UPDATE bookmarks SET checked = ?, changed = CASE WHEN ? THEN ? ELSE changed END WHERE url = ?',\
+            [(checked, changed, checked, url) for url, checked, changed in updates])
+    def close(self):
+        self.db.close()
+
+def bookmarksPath():
+    directory = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation), orgName)
+    os.makedirs(directory, exist_ok = True)
+    return os.path.join(directory, bookmarksFile)
+
 class MainWindow(QMainWindow):
     error = pyqtSignal(str)
+    cycleFinished = pyqtSignal()
     def __init__(self):
         super().__init__()
         self.ui = Ui_MainWindow()
@@ -594,13 +1531,23 @@ class MainWindow(QMainWindow):
         self.handler.setFormatter(logging.Formatter(logFormat))
         logging.getLogger().addHandler(self.handler)
         self.updateLogger()
+        global scriptExtraction
+        scriptExtraction = s.value('misc/script_extraction', True, type = bool)
         # Auto search
         self.model = Model()
         self.model.statusMessage.connect(self.showStatusMessage)
         self.model.progress.connect(self.showProgress)
+        self.model.newMatches.connect(self.notifyMatches)
+        self.crawler = SearchCrawler(self.model)
+        self.crawler.statusMessage.connect(self.showStatusMessage)
+        self.crawler.finished.connect(self.checkCycle)
+        self.model.progress.connect(lambda percent, self=self: self.checkCycle() if percent == 100 else None)
+        self.cycleRunning = False
+        global profiler
+        if os.environ.get('PST_PROFILE') or s.value('misc/profile', False, type = bool):
+            profiler = Profiler(os.path.dirname(self.logfilePath()))
+            logging.info('profiling refresh cycles to ' + profiler.directory)
         self.updateAutoSearch()
-        self.autoSearchPage = QWebEnginePage()
-        self.autoSearchPage.loadFinished.connect(self.searchPageLoaded)
         self.progressBar = QProgressBar()
         self.progressBar.setTextVisible(False)
         self.progressBar.setMaximumWidth(100)
@@ -611,30 +1558,52 @@ class MainWindow(QMainWindow):
         self.delegate = ItemDelegate()
         self.fontSize = 14
         self.ui.treeView.setHeaderHidden(True)
-        self.ui.treeView.setIconSize(QSize(40, 40))
+        self.ui.treeView.setIconSize(iconSize)
         self.ui.treeView.setStyleSheet("QTreeView {{font-size: {}pt;}}".format(self.fontSize))
-        self.ui.treeView.setModel(self.model)
+        self.filterModel = FilterModel(self.model.searchIndex)
+        self.filterModel.setSourceModel(self.model)
+        self.ui.treeView.setModel(self.filterModel)
         self.ui.treeView.setItemDelegate(self.delegate)
         self.ui.treeView.hideColumn(1)
         self.ui.treeView.setContextMenuPolicy(Qt.CustomContextMenu)
         self.ui.treeView.customContextMenuRequested.connect(self.onCustomMenu)
 
+        # bookmarks used to be one newline separated setting, they move to the store once it opens
         bookmarks = s.value('bookmarks/bookmarks_list', '')
-        self.bookmarksList = [baseUrl(line) for line in bookmarks.split('\n') if baseUrl(line)]
-        self.bookmarksList = list(dict.fromkeys(self.bookmarksList))
-        self.bookmarksModel = BookmarksModel(self.bookmarksList)
+        self.bookmarks = set(baseUrl(line) for line in bookmarks.split('\n') if baseUrl(line))
+        self.bookmarkStore = None
+        try:
+            self.bookmarkStore = BookmarkStore(bookmarksPath())
+            self.bookmarkStore.add(sorted(self.bookmarks))
+            s.remove('bookmarks/bookmarks_list')
+            self.bookmarks.update(self.bookmarkStore.urls())
+        except Exception as e:
+            logging.error('Error opening bookmarks: ' + str(e))
+            self.error.emit('Error opening bookmarks, they are kept in the settings instead: ' + str(e))
+            self.bookmarkStore = None
+            self.saveBookmarksSetting()
+        self.pendingBookmarks = deque()
+        self.checkedBookmarks = []
+        self.bookmarkTimer = QTimer()
+        self.bookmarkTimer.timeout.connect(self.queueBookmarks)
+        self.model.pageChecked.connect(self.bookmarkChecked)
+        self.bookmarksModel = BookmarksModel(self.bookmarks, self.model.searchIndex)
         self.bookmarksModel.setSourceModel(self.model)
         self.ui.bookmarksTreeView.setHeaderHidden(True)
-        self.ui.bookmarksTreeView.setIconSize(QSize(40, 40))
+        self.ui.bookmarksTreeView.setIconSize(iconSize)
         self.ui.bookmarksTreeView.setStyleSheet("QTreeView {{font-size: {}pt;}}".format(self.fontSize))
         self.ui.bookmarksTreeView.setModel(self.bookmarksModel)
         self.ui.bookmarksTreeView.setItemDelegate(self.delegate)
         self.ui.bookmarksTreeView.hideColumn(1)
         self.ui.bookmarksTreeView.setContextMenuPolicy(Qt.CustomContextMenu)
         self.ui.bookmarksTreeView.customContextMenuRequested.connect(self.onCustomMenu)
+        self.filterText = ''
+        self.ui.filterLineEdit.textChanged.connect(self.setFilter)
+        self.ui.bookmarksFilterLineEdit.textChanged.connect(self.setFilter)
         # Tray icon
         self.ui.prefsAction.triggered.connect(self.showPrefs)
         self.ui.refreshAction.triggered.connect(self.refresh)
+        self.ui.importBookmarksAction.triggered.connect(self.importBookmarks)
         self.ui.quitAction.triggered.connect(self.quit)
         self.ui.zoomInAction.triggered.connect(self.zoomIn)
         self.ui.zoomOutAction.triggered.connect(self.zoomOut)
@@ -661,8 +1630,20 @@ class MainWindow(QMainWindow):
         self.timer.timeout.connect(self.refresh)
         self.updateInterval(s.value('misc/interval', defaultInterval, type = int))
         self.timer.start()
-        self.messagesPage = QWebEnginePage()
+        self.messagesPage = QWebEnginePage(getBackgroundProfile())
         self.messagesPage.loadFinished.connect(self.messagesPageLoaded)
+        # plain HTTP access sharing the cookies of the web engine, to poll the unread counter cheaply
+        self.nam = QNetworkAccessManager(self)
+        self.cookieJar = QNetworkCookieJar(self)
+        self.nam.setCookieJar(self.cookieJar)
+        # the login happens in webView, mirror its cookies to the jar and the background profile
+        cookieStore = QWebEngineProfile.defaultProfile().cookieStore()
+        bgCookieStore = getBackgroundProfile().cookieStore()
+        cookieStore.cookieAdded.connect(self.cookieJar.insertCookie)
+        cookieStore.cookieRemoved.connect(self.cookieJar.deleteCookie)
+        cookieStore.cookieAdded.connect(lambda cookie, store=bgCookieStore: store.setCookie(cookie))
+        cookieStore.cookieRemoved.connect(lambda cookie, store=bgCookieStore: store.deleteCookie(cookie))
+        cookieStore.loadAllCookies()
         self.refresh()
     def zoomIn(self):
         currentIndex = self.ui.tabWidget.currentIndex()
@@ -706,7 +1687,7 @@ class MainWindow(QMainWindow):
         action = QAction("Open in default browser", self.contextMenu)
         action.triggered.connect(lambda checked, arg=url: subprocess.call([sys.executable, '-m', 'webbrowser', '-t', arg]))
         self.contextMenu.addAction(action)
-        if url not in self.bookmarksList:
+        if url not in self.bookmarks:
             enabled = True
             action = QAction("Add to bookmarks", self.contextMenu)
         else:
@@ -718,15 +1699,81 @@ class MainWindow(QMainWindow):
         action.triggered.connect(lambda checked, self=self, url=url: self.model.checkNow(url))
         self.contextMenu.addAction(action)
         self.contextMenu.exec(sender.viewport().mapToGlobal(point))
+    def setFilter(self, text):
+        if text == self.filterText:
+            return
+        self.filterText = text
+        # both tabs share one filter
+        for lineEdit in [self.ui.filterLineEdit, self.ui.bookmarksFilterLineEdit]:
+            if lineEdit.text() != text:
+                lineEdit.setText(text)
+        self.model.searchIndex.setQuery(text)
+        self.filterModel.refilter()
+        self.bookmarksModel.refilter()
     def setBookmarked(self, url, enabled):
-        bookmarked =  url in self.bookmarksList
+        if enabled == (url in self.bookmarks):
+            return
+        self.bookmarksModel.setBookmarked(url, enabled)
+        if not self.bookmarkStore:
+            self.saveBookmarksSetting()
+            return
+        try:
+            if enabled:
+                self.bookmarkStore.add([url])
+            else:
+                self.bookmarkStore.remove(url)
+        except Exception as e:
+            logging.error('Error saving bookmark: ' + str(e))
+            self.error.emit('Error saving bookmark: ' + str(e))
+    def saveBookmarksSetting(self):
+        # without a store bookmarks fall back to the old newline separated setting
         s = QSettings(orgName, appName)
-        if bookmarked and not enabled:
-            self.bookmarksList.remove(url)
-        elif enabled and not bookmarked:
-            self.bookmarksList.append(url)
-        self.bookmarksModel.invalidate()
-        s.setValue('bookmarks/bookmarks_list', '\n'.join(self.bookmarksList))
+        s.setValue('bookmarks/bookmarks_list', '\n'.join(sorted(self.bookmarks)))
+    def importBookmarks(self):
+        filename, _ = QFileDialog.getOpenFileName(self, 'Import bookmarks', '', 'Text files (*.txt);;All files (*)')
+        if not filename:
+            return
+        try:
+            with open(filename, encoding = 'utf-8', errors = 'replace') as f:
+                urls = list(dict.fromkeys(pattern.findall(f.read())))
+            if self.bookmarkStore:
+                added = self.bookmarkStore.add(urls)
+            else:
+                added = len(set(urls) - self.bookmarks)
+        except Exception as e:
+            logging.error('Error importing bookmarks: ' + str(e))
+            self.showStatusMessage('Error importing bookmarks: ' + str(e))
+            self.error.emit('Error importing bookmarks: ' + str(e))
+            return
+        self.bookmarks.update(urls)
+        if not self.bookmarkStore:
+            self.saveBookmarksSetting()
+        # one pass over the tree instead of a row at a time
+        self.bookmarksModel.refilter()
+        self.showStatusMessage('Imported {} new bookmarks'.format(added))
+    def bookmarkChecked(self, url, changed):
+        if url not in self.bookmarks or not self.bookmarkStore:
+            return
+        self.checkedBookmarks.append((url, time.time(), changed))
+        if len(self.checkedBookmarks) >= bookmarkChunk:
+            self.saveCheckedBookmarks()
+    def saveCheckedBookmarks(self):
+        if not self.checkedBookmarks or not self.bookmarkStore:
+            return
+        try:
+            self.bookmarkStore.checked(self.checkedBookmarks)
+        except Exception as e:
+            logging.error('Error saving bookmarks: ' + str(e))
+        self.checkedBookmarks = []
+    def queueBookmarks(self):
+        # a chunk per event loop pass keeps the GUI responsive with large bookmark lists
+        for i in range(min(bookmarkChunk, len(self.pendingBookmarks))):
+            url = self.pendingBookmarks.popleft()
+            if url in self.bookmarks:
+                self.model.queueUrl(url, False, source = CacheSource.BOOKMARK)
+        if not self.pendingBookmarks:
+            self.bookmarkTimer.stop()
+            self.checkCycle()
     def toBrowser(self, url):
         self.ui.webView.setUrl(QUrl(url))
         self.ui.tabWidget.setCurrentIndex(0)
@@ -737,6 +1784,12 @@ class MainWindow(QMainWindow):
         logging.getLogger().setLevel(logLevels[newLevel])
         for h in logging.getLogger().handlers:
             h.setLevel(logLevels[newLevel])
+    def logfilePath(self):
+        s = QSettings(orgName, appName)
+        f = s.value('logfile/filename', defaultLogfile)
+        if not os.path.isabs(f):
+            f = os.path.join(baseDir, f)
+        return f
     def updateLogger(self):
         logging.debug("updating logger handlers")
         s = QSettings(orgName, appName)
@@ -744,9 +1797,7 @@ class MainWindow(QMainWindow):
             logging.getLogger().removeHandler(self.fileHandler)
             self.fileHandler = None
         if s.value('logfile/enable', False, type = bool):
-            f = s.value('logfile/filename', defaultLogfile)
-            if not os.path.isabs(f):
-                f = os.path.join(baseDir, f)
+            f = self.logfilePath()
             logging.debug('new file handler for ' + f)
             fileHandler = logging.FileHandler(f)
             level = s.value('misc/loglevel', defaultLevel, type = int)
@@ -762,18 +1813,40 @@ class MainWindow(QMainWindow):
         wantListStr = s.value('autosearch/want_list', '')
         wantList = [line.strip().lower() for line in wantListStr.split('\n') if line.strip()]
         self.model.updateLists(haveList, wantList)
-    def searchPageLoaded(self, ok):
-        if not ok:
-            logging.warning('Failed to load URL: ' + stUrl.toString())
-            return
-        self.autoSearchPage.toHtml(self.model.parseSearchResults)
+        queries = s.value('autosearch/queries', '')
+        self.crawler.setQueries([line.strip() for line in queries.split('\n') if line.strip()])
+        self.model.cache.setTtl(CacheSource.SEARCH, s.value('cache/search_ttl', defaultSearchTtl, type = int))
+        self.model.cache.setTtl(CacheSource.BOOKMARK, s.value('cache/bookmark_ttl', defaultBookmarkTtl, type = int))
+        self.model.cache.errorTtl = s.value('cache/error_ttl', defaultErrorTtl, type = int)
     def refresh(self):
-        self.messagesPage.setUrl(messagesUrl)
+        self.pollMessages()
+        self.model.purgeCache()
         if not self.autoSearchEnabled:
             return
-        self.autoSearchPage.setUrl(stUrl)
-        for url in self.bookmarksList:
-            self.model.queueUrl(url, False)
+        if not self.cycleRunning:
+            if profiler:
+                profiler.startCycle()
+            # matches stay highlighted until the next refresh
+            self.model.clearHighlights()
+            self.cycleRunning = True
+        self.crawler.crawl()
+        if self.bookmarkStore:
+            self.pendingBookmarks = deque(url for url in self.bookmarkStore.urls() if url in self.bookmarks)
+        else:
+            self.pendingBookmarks = deque(self.bookmarks)
+        self.bookmarkTimer.start()
+    def checkCycle(self):
+        # searches, bookmarks and retries queue pages at different times, a refresh is over once all are done
+        if self.quitting or self.crawler.pending or self.pendingBookmarks or self.model.queued:
+            return
+        running = self.cycleRunning
+        self.cycleRunning = False
+        self.saveCheckedBookmarks()
+        self.model.reportMatches()
+        if profiler:
+            profiler.finishCycle()
+        if running:
+            self.cycleFinished.emit()
     def updateInterval(self, newInterval):
         logging.info('setting refresh interval: {} minutes'.format(newInterval))
         self.timer.setInterval(newInterval * 1000 * 60)
@@ -783,6 +1856,9 @@ class MainWindow(QMainWindow):
         self.model.cancelAll.emit()
         self.statusBar().showMessage('Waiting for worker threads...')
         QThreadPool.globalInstance().waitForDone()
+        if self.bookmarkStore:
+            self.saveCheckedBookmarks()
+            self.bookmarkStore.close()
         QApplication.setQuitOnLastWindowClosed(True)
         self.close()
     def loadFinished(self, ok):
@@ -795,16 +1871,70 @@ class MainWindow(QMainWindow):
         if not self.autoSearchEnabled:
             return
         url = self.ui.webView.url().toString()
-        if url == stUrl.toString() or url.startswith('https://www.steamtrades.com/trades/search'):
-            self.ui.webView.page().toHtml(self.model.parseSearchResults)
-        elif url.startswith('https://www.steamtrades.com/trade/'):
+        if url == stUrl.toString() or url.startswith(searchUrl):
+            if scriptExtraction:
+                self.ui.webView.page().runJavaScript(searchScript, QWebEngineScript.ApplicationWorld, self.searchExtracted)
+            else:
+                self.ui.webView.page().toHtml(self.model.parseSearchResults)
+        elif url.startswith(siteUrl + '/trade/'):
             self.model.queueUrl(url, False)
 
+    def searchExtracted(self, result):
+        try:
+            rows = json.loads(result)
+        except Exception as e:
+            logging.warning('Script extraction failed, using HTML: ' + str(e))
+            self.ui.webView.page().toHtml(self.model.parseSearchResults)
+            return
+        self.model.queueSearchResults(rows)
+    def pollMessages(self):
+        getRateLimiter().acquire(self.sendPoll)
+    def sendPoll(self):
+        request = QNetworkRequest(messagesUrl)
+        request.setAttribute(QNetworkRequest.FollowRedirectsAttribute, True)
+        reply = self.nam.get(request)
+        reply.finished.connect(lambda self=self, reply=reply, started=time.monotonic():\
+        self.messagesPolled(reply, time.monotonic() - started))
+    def loadMessagesPage(self):
+        getRateLimiter().acquire(lambda self=self: self.messagesPage.setUrl(messagesUrl))
+    def messagesPolled(self, reply, latency):
+        reply.deleteLater()
+        getRateLimiter().report(reply.error() == QNetworkReply.NoError, latency)
+        if reply.error() != QNetworkReply.NoError:
+            logging.warning('Error polling messages: ' + reply.errorString())
+            self.loadMessagesPage()
+            return
+        page = bytes(reply.readAll()).decode('utf8', 'replace')
+        if '<span>Messages' not in page:
+            # our cookies are not logged in (yet), let the web engine profile try
+            self.loadMessagesPage()
+            return
+        m = messageCountPattern.search(page)
+        count = int(m[1].replace(',', '')) if m else 0
+        logging.debug('polled message count: {}'.format(count))
+        if count == 0:
+            self.trayIcon.setIcon(readIcon)
+            self.setWindowIcon(readIcon)
+        else:
+            # the count alone can't tell a new message from one read meanwhile, so the full page
+            # is loaded whenever something is unread and its permalinks tell what is new
+            self.loadMessagesPage()
     def messagesPageLoaded(self, ok):
         if not ok:
             logging.warning('failed to load URL: ' + self.messagesPage.url().toString())
             return
-        self.messagesPage.toHtml(self.checkMessages)
+        if scriptExtraction:
+            self.messagesPage.runJavaScript(messagesScript, QWebEngineScript.ApplicationWorld, self.messagesExtracted)
+        else:
+            self.messagesPage.toHtml(self.checkMessages)
+    def messagesExtracted(self, result):
+        try:
+            data = json.loads(result)
+        except Exception as e:
+            logging.warning('Script extraction failed, using HTML: ' + str(e))
+            self.messagesPage.toHtml(self.checkMessages)
+            return
+        self.processMessages(data)
     def closeEvent(self,  event):
         if not self.quitting:
             self.hide()
@@ -840,37 +1970,80 @@ class MainWindow(QMainWindow):
         self.showError(msg)
         if permalink in self.permalinks:
             self.permalinks.remove(permalink)
+    def sendEmail(self, template, permalink = '', **fields):
+        s = QSettings(orgName, appName)
+        sender = s.value('email/sender')
+        recipient =s.value('email/recipient')
+        smtpServer = s.value('email/host')
+        smtpPort = s.value('email/port')
+        encryption = s.value('email/encryption_type') if s.value('email/encrypt', False, type=bool) else ''
+        username = s.value('email/username') if s.value('email/login', False, type=bool) else ''
+        password = ''
+        try:
+            if s.value('email/login', False, type=bool):
+                password = keyring.get_password(sysName,  "email/password")
+        except Exception as e:
+            logging.warning('Cannot read password from keyring: ' + str(e))
+        mailSender = MailSender(sender, recipient, smtpServer, smtpPort, encryption, username, password,\
+        template.format(sender = sender,  recipient = recipient, **fields), permalink)
+        logging.info('sending email...')
+        mailSender.emitter.error.connect(self.onMailError)
+        QThreadPool.globalInstance().start(mailSender)
+    def notifyMatches(self, matches):
+        s = QSettings(orgName, appName)
+        logging.info('{} new matches'.format(len(matches)))
+        if s.value('autosearch/notify', True, type = bool):
+            lines = ['{}: {}'.format(title, line) for title, url, line in matches]
+            summary = '\n'.join(lines[:5])
+            if len(lines) > 5:
+                summary += '\n... and {} more'.format(len(lines) - 5)
+            self.trayIcon.showMessage('{} new match(es)'.format(len(matches)), summary)
+        if s.value('email/notify', False, type = bool) and s.value('autosearch/email', False, type = bool):
+            details = '\n'.join('{}\n{}\n'.format(line, url) for title, url, line in matches)
+            self.sendEmail(matchesTemplate, count = len(matches), matches = details)
     def checkMessages(self,  page):
+        soup = BeautifulSoup(page, 'html.parser')
+        data = {'loggedIn': '<span>Messages' in page, 'count': None, 'comments': []}
+        messageCount = soup.find('span', attrs={'class': 'message_count'})
+        if messageCount:
+            data['count'] = messageCount.text
+        for comment in soup.find_all('div', attrs={'class': 'comment_inner'}):
+            if comment.find('div', attrs={'class': 'comment_unread'}) == None:
+                continue
+            author = comment.find('a', attrs={'class': 'author_name'})
+            message = comment.find('div', attrs={'class': 'comment_body_default markdown'})
+            links = comment.find_all('a')
+            data['comments'].append({'author': author.text if author else None,\
+            'message': message.text if message else None, 'permalink': links[-1].get('href') if links else None})
+        self.processMessages(data)
+    def processMessages(self, data):
         url = self.messagesPage.url()
         logging.info('loaded page ' + url.toString())
-        soup = BeautifulSoup(page, 'html.parser')
-        if url.host() == 'www.steamtrades.com' or url.host() == 'steamtrades.com':
-            if '<span>Messages' not in page:
+        if url.host() in stHosts:
+            if not data['loggedIn']:
                 logging.warning('log in to SteamTrades to receive message notifications')
                 return
         if url != messagesUrl:
             return
-        messageCount = soup.find('span', attrs={'class': 'message_count'})
+        messageCount = data['count']
         if not messageCount:
             self.trayIcon.setIcon(readIcon)
             self.setWindowIcon(readIcon)
             return
 
-        logging.debug('message count:' + messageCount.text)
+        logging.debug('message count:' + messageCount)
 
         self.trayIcon.setIcon(unreadIcon)
         self.setWindowIcon(unreadIcon)
         try:
             parsed = 0
-            for comment in soup.find_all('div', attrs={'class': 'comment_inner'}):
-                if parsed >= int(messageCount.text):
+            for comment in data['comments']:
+                if parsed >= int(messageCount.replace(',', '')):
                     break
-                if comment.find('div', attrs={'class': 'comment_unread'}) == None:
-                    continue
                 parsed += 1
-                author = comment.find('a', attrs={'class': 'author_name'}).text.strip()
-                message = comment.find('div', attrs={'class': 'comment_body_default markdown'}).text.strip()
-                permalink = comment.find_all('a')[-1]['href']
+                author = comment['author'].strip()
+                message = comment['message'].strip()
+                permalink = comment['permalink']
                 if permalink not in self.permalinks:
                     logging.debug('unread comment: \n' + str(comment))
                     logging.debug('author: ' + author)
@@ -879,23 +2052,7 @@ class MainWindow(QMainWindow):
                     self.trayIcon.showMessage("New message from " + author,  message)
                     s = QSettings(orgName, appName)
                     if s.value('email/notify', False, type=bool):
-                        sender = s.value('email/sender')
-                        recipient =s.value('email/recipient')
-                        smtpServer = s.value('email/host')
-                        smtpPort = s.value('email/port')
-                        encryption = s.value('email/encryption_type') if s.value('email/encrypt', False, type=bool) else ''
-                        username = s.value('email/username') if s.value('email/login', False, type=bool) else ''
-                        password = ''
-                        try:
-                            if s.value('email/login', False, type=bool):
-                                password = keyring.get_password(sysName,  "email/password")
-                        except Exception as e:
-                            logging.warning('Cannot read password from keyring: ' + str(e))
-                        mailSender = MailSender(sender, recipient, smtpServer, smtpPort, encryption, username, password,\
-                        messageTemplate.format(sender = sender,  recipient = recipient, count = messageCount.text, author = author, message = message), permalink)
-                        logging.info('sending email...')
-                        mailSender.emitter.error.connect(self.onMailError)
-                        QThreadPool.globalInstance().start(mailSender)
+                        self.sendEmail(messageTemplate, permalink, count = messageCount, author = author, message = message)
                     self.permalinks.append(permalink)
         except Exception as e:
             logging.error(str(e))
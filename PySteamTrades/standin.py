@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Local stand-in for SteamTrades.com serving synthetic search listings, trade pages and messages.
+# Point PySteamTrades at it with PST_SITE_URL=http://127.0.0.1:<port>
+
+import sys, argparse, random, threading, time, struct, zlib, logging
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+listingTemplate = """\
+<html><head><title>SteamTrades</title></head><body>
+<header><a href="/messages"><span>Messages</span>{count}</a></header>
+<div class="page_heading"><h1>Trades</h1></div>
+{rows}
+</body></html>
+"""
+
+rowTemplate = """\
+<div class="row_inner_wrap"><h3><a href="/trade/{id_}/{slug}">{title}</a>{lock}</h3></div>
+"""
+
+tradeTemplate = """\
+<html><head><title>{title}</title></head><body>
+<header><a href="/messages"><span>Messages</span>{count}</a></header>
+{closed}<div class="page_heading"><h1>{title}</h1></div>
+<div class="comment_inner"><a class="author_avatar" style="background-image:url({base}/avatar/{avatar}.png);"></a>
+<div class="have markdown">
+{have}
+</div>
+<div class="want markdown">
+{want}
+</div>
+</div>
+</body></html>
+"""
+
+messagesTemplate = """\
+<html><head><title>Messages</title></head><body>
+<header><a href="/messages"><span>Messages</span>{count}</a></header>
+<div class="page_heading"><h1>Messages</h1></div>
+{comments}
+</body></html>
+"""
+
+commentTemplate = """\
+<div class="comment_inner">{unread}<a class="author_name" href="/user/{n}">Trader {n}</a>
+<div class="comment_body_default markdown">Synthetic message {n}</div>
+<a href="/trade/{id_}/trade-{id_}/#comment-{n}">Permalink</a></div>
+"""
+
+countTemplate = '<span class="message_count">{}</span>'
+
+class StandInConfig:
+    def __init__(self, pages = 50, lines = 20, matches = 0.1, closed = 0.1, messages = 0, avatars = 20,\
+    latency = 0.0, jitter = 0.0, errorRate = 0.0, timeoutRate = 0.0, timeoutDelay = 30.0, seed = 0):
+        self.pages = pages
+        self.lines = lines
+        self.matches = matches
+        self.closed = closed
+        self.messages = messages
+        self.avatars = avatars
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.timeoutRate = timeoutRate
+        self.timeoutDelay = timeoutDelay
+        self.seed = seed
+
+def tradeId(n):
+    return '{:05x}'.format(n)
+
+def makePng(size, color):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    row = b'\x00' + bytes(color) * size
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))\
+    + chunk(b'IDAT', zlib.compress(row * size)) + chunk(b'IEND', b'')
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def log_message(self, format, *args):
+        logging.debug('stand-in: ' + format % args)
+    def do_GET(self):
+        config = self.server.config
+        self.server.countRequest()
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < config.timeoutRate:
+            # hang, then drop the connection without a response
+            time.sleep(config.timeoutDelay)
+            self.close_connection = True
+            return
+        if roll < config.timeoutRate + config.errorRate:
+            self.reply(500, b'Internal server error', 'text/plain')
+            return
+        path = urlparse(self.path).path
+        parts = [part for part in path.split('/') if part]
+        if not parts or parts[:2] == ['trades', 'search']:
+            self.reply(200, self.listing().encode('utf8'))
+        elif parts[0] == 'trade' and len(parts) >= 2:
+            self.reply(200, self.trade(parts[1]).encode('utf8'))
+        elif parts == ['messages']:
+            self.reply(200, self.messages().encode('utf8'))
+        elif parts[0] == 'avatar' and len(parts) == 2:
+            self.reply(200, self.server.avatar(parts[1]), 'image/png')
+        else:
+            self.reply(404, b'Not found', 'text/plain')
+    def reply(self, code, body, contentType = 'text/html; charset=utf-8'):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def messageCount(self):
+        config = self.server.config
+        return countTemplate.format(config.messages) if config.messages else ''
+    def listing(self):
+        config = self.server.config
+        rows = []
+        for n in range(config.pages):
+            rng = random.Random(config.seed * 1000003 + n)
+            id_ = tradeId(n)
+            lock = '<i class="red fa fa-lock"></i>' if rng.random() < config.closed else ''
+            rows.append(rowTemplate.format(id_ = id_, slug = 'trade-' + id_, title = 'Trade ' + id_, lock = lock))
+        return listingTemplate.format(count = self.messageCount(), rows = ''.join(rows))
+    def trade(self, id_):
+        config = self.server.config
+        try:
+            n = int(id_, 16)
+        except ValueError:
+            n = 0
+        rng = random.Random(config.seed * 1000003 + n)
+        closed = rng.random() < config.closed
+        def lines(prefix):
+            result = []
+            for i in range(config.lines):
+                if rng.random() < config.matches:
+                    result.append('<p>{} Wanted Game {}</p>'.format(prefix, rng.randrange(1000)))
+                else:
+                    result.append('<p>{} Filler Game {}</p>'.format(prefix, rng.randrange(100000)))
+            return '\n'.join(result)
+        host = self.headers.get('Host', '{}:{}'.format(*self.server.server_address[:2]))
+        return tradeTemplate.format(title = 'Trade ' + id_, count = self.messageCount(),\
+        closed = '<div class="notification yellow">Closed</div>' if closed else '',\
+        base = 'http://' + host, avatar = n % max(config.avatars, 1), have = lines('H'), want = lines('W'))
+    def messages(self):
+        config = self.server.config
+        comments = []
+        for n in range(max(config.messages, 3)):
+            unread = '<div class="comment_unread"></div>' if n < config.messages else ''
+            comments.append(commentTemplate.format(unread = unread, n = n, id_ = tradeId(n)))
+        return messagesTemplate.format(count = self.messageCount(), comments = ''.join(comments))
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    def __init__(self, address, config):
+        super().__init__(address, Handler)
+        self.config = config
+        self.requests = 0
+        self.mutex = threading.Lock()
+        self.avatars = {}
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+    def countRequest(self):
+        with self.mutex:
+            self.requests += 1
+    def avatar(self, name):
+        with self.mutex:
+            if name not in self.avatars:
+                rng = random.Random(name)
+                # full size Steam avatars are 184x184
+                self.avatars[name] = makePng(184, [rng.randrange(256) for i in range(3)])
+            return self.avatars[name]
+
+def addArguments(parser):
+    parser.add_argument('--port', type = int, default = 0, help = 'port to listen on, 0 picks a free one')
+    parser.add_argument('--pages', type = int, default = 50, help = 'trade pages listed in search results')
+    parser.add_argument('--lines', type = int, default = 20, help = 'have and want lines per trade page')
+    parser.add_argument('--matches', type = float, default = 0.1, help = 'fraction of lines matching "wanted game"')
+    parser.add_argument('--closed', type = float, default = 0.1, help = 'fraction of closed trades')
+    parser.add_argument('--messages', type = int, default = 0, help = 'unread messages')
+    parser.add_argument('--avatars', type = int, default = 20, help = 'distinct trader avatars')
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every response')
+    parser.add_argument('--jitter', type = float, default = 0.0, help = 'random extra latency, in seconds')
+    parser.add_argument('--error-rate', type = float, default = 0.0, help = 'fraction of requests answered with 500')
+    parser.add_argument('--timeout-rate', type = float, default = 0.0, help = 'fraction of requests that hang')
+    parser.add_argument('--timeout-delay', type = float, default = 30.0, help = 'seconds a hanging request waits before closing')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed for the synthetic content')
+
+def configFromArgs(args):
+    return StandInConfig(args.pages, args.lines, args.matches, args.closed, args.messages, args.avatars,\
+    args.latency, args.jitter, args.error_rate, args.timeout_rate, args.timeout_delay, args.seed)
+
+def startServer(config, port = 0):
+    server = StandInServer(('127.0.0.1', port), config)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Stand-in SteamTrades server')
+    addArguments(parser)
+    args = parser.parse_args()
+    server = StandInServer(('127.0.0.1', args.port), configFromArgs(args))
+    print('Serving on ' + server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)